@@ -1,22 +1,121 @@
 """
-Pull Meta Ads performance, save as CSV, and e-mail the files.
-Reads all credentials and settings from a .env file via python-dotenv.
+Pull Meta Ads performance, save as CSV (gzipped) or Parquet, and e-mail the files.
+Reads credentials and settings from the environment, filling gaps from a
+local .env file (see .env.example) via python-dotenv.
 """
 import sys
 import os
+import logging
+import io
 import time
+import sqlite3
+import gzip
+import shutil
 import ssl
+import asyncio
 import smtplib
+from contextlib import closing
+from functools import lru_cache
+from types import SimpleNamespace
 from email.message import EmailMessage
+from operator import itemgetter
 from pathlib import Path
 from datetime import datetime
-import requests
+import aiohttp
+import orjson
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 
 
+logger = logging.getLogger(__name__)
+
+# Transient Graph API failures are retried with exponential backoff
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Meta mostly signals throttling as HTTP 400/403 with one of these codes
+THROTTLE_CODES = frozenset({4, 17, 32, 613, *range(80000, 80015)})
+MAX_RETRIES    = 4
+RETRY_BACKOFF  = 2.0        # seconds, doubled on every further attempt
+MAX_RETRY_WAIT = 300        # cap on any single wait, hinted or not
+
+
+def is_throttled(body):
+    """True if a 400/403 Graph API error body asks us to retry later."""
+    try:
+        err = orjson.loads(body).get("error") or {}
+    except (orjson.JSONDecodeError, AttributeError):
+        return False
+    return err.get("code") in THROTTLE_CODES or bool(err.get("is_transient"))
+
+
+def retry_hint(headers):
+    """Seconds the server asked us to wait, or None if it gave no hint.
+
+    Reads Retry-After, then the largest estimated_time_to_regain_access
+    (minutes) in x-business-use-case-usage.
+    """
+    try:
+        return float(headers["Retry-After"])
+    except (KeyError, ValueError):
+        pass
+    try:
+        usage   = orjson.loads(headers.get("x-business-use-case-usage") or "{}")
+        minutes = max(
+            (
+                e.get("estimated_time_to_regain_access") or 0
+                for entries in usage.values()
+                for e in entries
+            ),
+            default=0,
+        )
+    except (orjson.JSONDecodeError, AttributeError, TypeError):
+        return None
+    return minutes * 60 if minutes else None
+
+
 # ───────────────────────── FACEBOOK HELPERS ──────────────────────────
-def get_facebook_ads_account(access_token: str, api_version: str):
+async def fetch_json(session, sem, url, params=None, timeout=60):
+    """GET *url* on the shared session and return the decoded JSON body.
+
+    Every Graph API call goes through here, so the run-wide semaphore *sem*
+    caps the total concurrency and keeps us under Meta's rate limiter.
+    Throttling (429, or 400/403 with a THROTTLE_CODES / is_transient error),
+    5xx answers, dropped connections and timeouts are retried up to
+    MAX_RETRIES times.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        last_try = attempt == MAX_RETRIES
+        hint     = None
+        try:
+            async with sem:
+                async with session.get(
+                    url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as r:
+                    body  = await r.read()
+                    retry = r.status in RETRY_STATUSES or (
+                        r.status in (400, 403) and is_throttled(body)
+                    )
+                    if not retry or last_try:
+                        r.raise_for_status()
+                        # orjson straight from bytes; also sidesteps the
+                        # text/javascript content type Graph API sometimes sends
+                        return orjson.loads(body)
+                    hint   = retry_hint(r.headers)
+                    reason = f"HTTP {r.status}: {body[:200].decode(errors='replace')}"
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if last_try:
+                raise
+            reason = repr(e)
+
+        wait = min(RETRY_BACKOFF * 2 ** attempt if hint is None else hint, MAX_RETRY_WAIT)
+        logger.warning(
+            "Graph API retry %d/%d in %.0f s (%s)", attempt + 1, MAX_RETRIES, wait, reason
+        )
+        # back off outside the semaphore so other requests keep flowing
+        await asyncio.sleep(wait)
+
+
+async def get_facebook_ads_account(session, sem, access_token: str, api_version: str):
     """Return list of ad-accounts the token can access."""
     try:
         url = f"https://graph.facebook.com/{api_version}/me/adaccounts"
@@ -24,19 +123,19 @@ def get_facebook_ads_account(access_token: str, api_version: str):
             "fields": "name,account_id,currency,timezone_id",
             "access_token": access_token,
         }
-        r = requests.get(url, params=params, timeout=30)
-        r.raise_for_status()
-        jsn = r.json()
+        jsn = await fetch_json(session, sem, url, params, timeout=30)
         if "error" in jsn:
-            print(f"API error: {jsn['error']}")
+            logger.error("API error: %s", jsn["error"])
             return []
         return jsn.get("data", [])
-    except Exception as e:
-        print(f"get_facebook_ads_account() failed: {e}")
+    except Exception:
+        logger.exception("get_facebook_ads_account() failed")
         return []
 
 
-def get_ad_creative_insights(
+async def get_ad_creative_insights(
+    session,
+    sem,
     account_id: str,
     access_token: str,
     api_version: str,
@@ -49,157 +148,302 @@ def get_ad_creative_insights(
             "level": "ad",
             "date_preset": date_preset,
             "fields": (
-                "date_start,account_id,campaign_id,campaign_name,"
+                "date_start,campaign_id,campaign_name,"
                 "adset_id,adset_name,ad_id,ad_name,impressions,clicks,spend,"
                 "actions,action_values"
             ),
+            # one entry per action_type – the only breakdown CONV_TYPES needs
+            "action_breakdowns": "action_type",
+            "limit": 500,                   # fewer, larger pages
             "access_token": access_token,
         }
 
         all_rows = []
         while True:
-            r = requests.get(url, params=params, timeout=60)
-            r.raise_for_status()
-            jsn = r.json()
+            jsn = await fetch_json(session, sem, url, params)
             if "error" in jsn:
-                print(f"Insights error: {jsn['error']}")
+                logger.error("Insights error: %s", jsn["error"])
                 break
             all_rows.extend(jsn.get("data", []))
             next_url = jsn.get("paging", {}).get("next")
             if not next_url:
                 break
-            url, params = next_url, {}          # next already includes token
-            time.sleep(0.1)
-        print(f"Retrieved {len(all_rows)} insight rows")
+            url, params = next_url, None        # next already includes token
+        logger.info("act_%s: retrieved %d insight rows", account_id, len(all_rows))
         return all_rows
-    except Exception as e:
-        print(f"get_ad_creative_insights() failed: {e}")
+    except Exception:
+        logger.exception("get_ad_creative_insights() failed")
         return []
 
 
-def get_ad_creatives_details(ad_ids, access_token, api_version):
-    """Return dict keyed by ad_id → creative meta."""
-    out, batch = {}, 50
-    for i in range(0, len(ad_ids), batch):
-        ids = ",".join(ad_ids[i:i + batch])
-        try:
-            url = f"https://graph.facebook.com/{api_version}/"
-            params = {
-                "ids": ids,
-                "fields": (
-                    "id,name,"
-                    "creative.fields(id,name,object_story_spec,asset_feed_spec,"
-                    "image_hash,video_id,thumbnail_url)"
-                ),
-                "access_token": access_token,
+async def get_ad_creatives_batch(session, sem, ids, access_token, api_version):
+    """Return creative meta for one batch of ≤50 ad ids."""
+    out = {}
+    try:
+        url = f"https://graph.facebook.com/{api_version}/"
+        params = {
+            "ids": ",".join(ids),
+            "fields": (
+                "id,name,"
+                "creative.fields(id,name,object_story_spec,asset_feed_spec,"
+                "image_hash,video_id,thumbnail_url)"
+            ),
+            "access_token": access_token,
+        }
+        data = await fetch_json(session, sem, url, params)
+        for ad_id, ad in data.items():
+            if "creative" not in ad:
+                continue
+            c = ad["creative"]
+            out[ad_id] = {
+                "creative_id":   c.get("id"),
+                "creative_name": c.get("name"),
+                "image_hash":    c.get("image_hash"),
+                "video_id":      c.get("video_id"),
+                "thumbnail_url": c.get("thumbnail_url"),
+                "has_video": bool(c.get("video_id")),
+                "has_image": bool(c.get("image_hash")),
             }
-            r = requests.get(url, params=params, timeout=60)
-            r.raise_for_status()
-            data = r.json()
-            for ad_id, ad in data.items():
-                if "creative" not in ad:
-                    continue
-                c = ad["creative"]
-                out[ad_id] = {
-                    "creative_id":   c.get("id"),
-                    "creative_name": c.get("name"),
-                    "image_hash":    c.get("image_hash"),
-                    "video_id":      c.get("video_id"),
-                    "thumbnail_url": c.get("thumbnail_url"),
-                    "has_video": bool(c.get("video_id")),
-                    "has_image": bool(c.get("image_hash")),
-                }
-            time.sleep(0.1)
-        except Exception as e:
-            print(f"Creative-details batch failed: {e}")
+    except Exception:
+        logger.exception("Creative-details batch failed")
     return out
 
 
-# ────────────────────────── METRIC UTILITIES ─────────────────────────
-def calculate_metrics(insight):
-    spend   = float(insight.get("spend", 0))
-    actions = insight.get("actions", [])
-    values  = insight.get("action_values", [])
+async def get_ad_creatives_details(
+    session, sem, ad_ids, access_token, api_version, cache_path
+):
+    """Return dict keyed by ad_id → creative meta.
+
+    Ads seen within CREATIVE_CACHE_TTL are served from the on-disk cache at
+    *cache_path*; only the rest hit the Graph API.
+    """
+    # SQLite is blocking – keep it off the event loop
+    cached  = await asyncio.to_thread(load_cached_creatives, cache_path, ad_ids)
+    misses  = [a for a in ad_ids if a not in cached]
+    batch   = 50
+    batches = [misses[i:i + batch] for i in range(0, len(misses), batch)]
+    results = await asyncio.gather(
+        *[
+            get_ad_creatives_batch(session, sem, ids, access_token, api_version)
+            for ids in batches
+        ]
+    )
+    fetched = {}
+    for res in results:
+        fetched.update(res)
+    await asyncio.to_thread(store_cached_creatives, cache_path, fetched)
+    logger.info("Creative details: %d cached, %d fetched", len(cached), len(fetched))
+    return {**cached, **fetched}
+
+
+# ─────────────────────── CREATIVE DETAILS CACHE ──────────────────────
+CREATIVE_CACHE_TTL  = 7 * 86400         # seconds – creatives rarely change
+
+
+def open_creative_cache(path):
+    con = sqlite3.connect(path)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS creatives ("
+        "ad_id TEXT PRIMARY KEY, data TEXT NOT NULL, fetched_at REAL NOT NULL)"
+    )
+    return con
+
+
+def load_cached_creatives(path, ad_ids):
+    """Return {ad_id: creative meta} for the ids cached within the TTL."""
+    out, chunk = {}, 500                # stay under SQLite's variable limit
+    try:
+        with closing(open_creative_cache(path)) as con:
+            cutoff = time.time() - CREATIVE_CACHE_TTL
+            for i in range(0, len(ad_ids), chunk):
+                ids = ad_ids[i:i + chunk]
+                rows = con.execute(
+                    "SELECT ad_id, data FROM creatives "
+                    f"WHERE fetched_at > ? AND ad_id IN ({','.join('?' * len(ids))})",
+                    (cutoff, *ids),
+                )
+                out.update((ad_id, orjson.loads(data)) for ad_id, data in rows)
+    except sqlite3.Error:
+        logger.exception("Creative cache read failed")
+    return out
 
-    conv_types = {
-        "purchase",
-        "lead",
-        "complete_registration",
-        "add_to_cart",
-        "initiate_checkout",
-    }
 
-    conversions, conv_value = 0, 0.0
-    for a in actions:
-        if a.get("action_type") in conv_types:
-            conversions += int(float(a.get("value", 0)))
-    for v in values:
-        if v.get("action_type") in conv_types:
-            conv_value += float(v.get("value", 0))
+def store_cached_creatives(path, creatives):
+    """Upsert freshly fetched creative meta and drop expired entries."""
+    try:
+        with closing(open_creative_cache(path)) as con, con:
+            now = time.time()
+            con.executemany(
+                "INSERT OR REPLACE INTO creatives VALUES (?, ?, ?)",
+                [
+                    (ad_id, orjson.dumps(c).decode(), now)
+                    for ad_id, c in creatives.items()
+                ],
+            )
+            con.execute(
+                "DELETE FROM creatives WHERE fetched_at <= ?",
+                (now - CREATIVE_CACHE_TTL,),
+            )
+    except sqlite3.Error:
+        logger.exception("Creative cache write failed")
 
-    cpa  = spend / conversions if conversions else 0
-    roas = conv_value / spend  if spend else 0
 
-    return conversions, conv_value, round(cpa, 2), round(roas, 2)
+# ────────────────────────── METRIC UTILITIES ─────────────────────────
+CONV_TYPES = frozenset({
+    "purchase",
+    "lead",
+    "complete_registration",
+    "add_to_cart",
+    "initiate_checkout",
+})
+
+INSIGHT_COLUMNS = [
+    "date_start", "campaign_id", "campaign_name", "adset_id", "adset_name",
+    "ad_id", "ad_name", "impressions", "clicks", "spend",
+    "actions", "action_values",
+]
+CREATIVE_COLUMNS = ["creative_id", "creative_name", "image_hash", "video_id",
+                    "has_video", "has_image"]
+
+
+def conversion_totals(df):
+    """Sum conversion-type actions and action values per insight row.
+
+    Both action lists are exploded into one long frame, filtered on
+    CONV_TYPES once and aggregated in a single groupby. Returns an int
+    ``conversions`` and a float ``conversion_value`` column aligned with *df*.
+    """
+    out = pd.DataFrame({"conversions": 0, "conversion_value": 0.0}, index=df.index)
+    long = pd.concat(
+        {
+            "conversions":      df["actions"].explode(),
+            "conversion_value": df["action_values"].explode(),
+        },
+        names=["metric", "row"],
+    ).dropna()
+    if long.empty:
+        return out
+
+    acts = pd.json_normalize(long.tolist()).set_index(long.index)
+    acts = acts[acts["action_type"].isin(CONV_TYPES)]
+    vals = pd.to_numeric(acts["value"], errors="coerce").fillna(0)
+    # conversion counts are whole numbers – truncate each action first
+    is_count = vals.index.get_level_values("metric") == "conversions"
+    vals = vals.where(~is_count, np.trunc(vals))
+
+    totals = (
+        vals.groupby(level=["row", "metric"]).sum()
+        .unstack("metric")
+        .reindex(index=df.index, columns=out.columns)
+        .fillna(0)
+    )
+    return totals.astype({"conversions": int, "conversion_value": float})
+
+
+def round2(values):
+    """Round each value like the builtin ``round(x, 2)``.
+
+    ndarray.round(2) scales by 100 first, which can tip half-cent ties the
+    other way (spend 1.23 / 2 conversions → 0.62 instead of 0.61).
+    """
+    return np.array([round(v, 2) for v in values.tolist()], dtype=float)
 
 
 def process_creative_data(insights, creative_details):
-    rows = []
-    for ins in insights:
-        ad_id = ins["ad_id"]
-        c     = creative_details.get(ad_id, {})
-        conv, conv_val, cpa, roas = calculate_metrics(ins)
-
-        impr   = int(ins.get("impressions", 0))
-        clicks = int(ins.get("clicks", 0))
-        spend  = float(ins.get("spend", 0))
-
-        ctr = round(clicks / impr * 100, 2) if impr else 0
-        cpm = round(spend / impr * 1000, 2) if impr else 0
-
-        ctype = (
-            "Video"  if c.get("has_video") else
-            "Image"  if c.get("has_image") else
-            "Unknown"
-        )
+    """Join insights with creative meta and derive the report metrics."""
+    df = pd.DataFrame(insights).reindex(columns=INSIGHT_COLUMNS)
+
+    impr   = pd.to_numeric(df["impressions"], errors="coerce").fillna(0).astype(int)
+    clicks = pd.to_numeric(df["clicks"], errors="coerce").fillna(0).astype(int)
+    spend  = pd.to_numeric(df["spend"], errors="coerce").fillna(0).astype(float)
+
+    totals   = conversion_totals(df)
+    conv     = totals["conversions"]
+    conv_val = totals["conversion_value"]
+
+    cpa  = round2(np.where(conv > 0, spend / conv, 0))
+    roas = round2(np.where(spend > 0, conv_val / spend, 0))
+    ctr  = round2(np.where(impr > 0, clicks / impr * 100, 0))
+    cpm  = round2(np.where(impr > 0, spend / impr * 1000, 0))
+
+    c = (
+        pd.DataFrame.from_dict(creative_details, orient="index")
+        .reindex(columns=CREATIVE_COLUMNS)
+        .reindex(df["ad_id"])
+        .reset_index(drop=True)
+    )
+    ctype = np.select(
+        [c["has_video"].eq(True), c["has_image"].eq(True)],
+        ["Video", "Image"],
+        default="Unknown",
+    )
+
+    return pd.DataFrame(
+        {
+            "date": df["date_start"],
+            "campaign_id": df["campaign_id"],
+            "campaign_name": df["campaign_name"],
+            "adset_id": df["adset_id"],
+            "adset_name": df["adset_name"],
+            "ad_id": df["ad_id"],
+            "ad_name": df["ad_name"],
+            "creative_id": c["creative_id"],
+            "creative_name": c["creative_name"],
+            "creative_type": ctype,
+            "image_hash": c["image_hash"],
+            "video_id": c["video_id"],
+            "spend": spend,
+            "impressions": impr,
+            "clicks": clicks,
+            "conversions": conv,
+            "conversion_value": conv_val,
+            "cpa": cpa,
+            "roas": roas,
+            "ctr": ctr,
+            "cpm": cpm,
+        }
+    )
 
-        rows.append(
-            {
-                "date": ins["date_start"],
-                "campaign_id": ins["campaign_id"],
-                "campaign_name": ins["campaign_name"],
-                "adset_id": ins["adset_id"],
-                "adset_name": ins["adset_name"],
-                "ad_id": ad_id,
-                "ad_name": ins["ad_name"],
-                "creative_id": c.get("creative_id"),
-                "creative_name": c.get("creative_name"),
-                "creative_type": ctype,
-                "image_hash": c.get("image_hash"),
-                "video_id": c.get("video_id"),
-                "spend": spend,
-                "impressions": impr,
-                "clicks": clicks,
-                "conversions": conv,
-                "conversion_value": conv_val,
-                "cpa": cpa,
-                "roas": roas,
-                "ctr": ctr,
-                "cpm": cpm,
-            }
-        )
-    return rows
 
+def sort_by_spend(df, topn=0):
+    """Order rows by spend, descending – partial top-N sort if *topn* > 0."""
+    if topn > 0:
+        return df.nlargest(topn, "spend")
+    return df.sort_values("spend", ascending=False, kind="quicksort")
 
-def save_to_csv(rows, path):
-    if not rows:
+
+def save_to_csv(df, path, topn=0):
+    if df.empty:
         return False
-    df = pd.DataFrame(rows).sort_values("spend", ascending=False)
+    df = sort_by_spend(df, topn)
     df.to_csv(path, index=False)
-    print(f"Saved → {path} ({len(df)} rows, spend ${df['spend'].sum():.2f})")
+    logger.info("Saved → %s (%d rows, spend $%.2f)", path, len(df), df["spend"].sum())
+    return True
+
+
+# Pinned to string so every daily Parquet file shares one schema – an
+# all-null column (e.g. no creative matched) would otherwise be float64
+TEXT_COLUMNS = [
+    "date", "campaign_id", "campaign_name", "adset_id", "adset_name",
+    "ad_id", "ad_name", "creative_id", "creative_name", "creative_type",
+    "image_hash", "video_id",
+]
+
+
+def save_to_parquet(df, path, topn=0):
+    if df.empty:
+        return False
+    df = sort_by_spend(df, topn).astype({col: "string" for col in TEXT_COLUMNS})
+    df.to_parquet(path, index=False, compression="snappy")
+    logger.info("Saved → %s (%d rows, spend $%.2f)", path, len(df), df["spend"].sum())
     return True
 
 
+# REPORT_FORMAT → writer; csv (default) is what recipients open today,
+# parquet is ~5-10× smaller
+REPORT_WRITERS = {"csv": save_to_csv, "parquet": save_to_parquet}
+
+
 # ───────────────────────────── EMAIL SENDER ──────────────────────────
 def send_email_with_attachments(
     smtp_host,
@@ -218,16 +462,29 @@ def send_email_with_attachments(
     msg["To"]      = ", ".join(recipients)
     msg.set_content(body)
 
-    # Attach all CSV files
+    # Attach all reports – CSVs gzip-compressed on the way in, Parquet
+    # files as-is (already snappy-compressed)
     for fp in files:
         p = Path(fp)
         if not p.exists():
             continue
+        if p.suffix == ".parquet":
+            with p.open("rb") as fh:
+                msg.add_attachment(
+                    fh.read(),
+                    maintype="application",
+                    subtype="octet-stream",
+                    filename=p.name,
+                )
+            continue
+        buf = io.BytesIO()
+        with p.open("rb") as fh, gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+            shutil.copyfileobj(fh, gz)
         msg.add_attachment(
-            p.read_bytes(),
-            maintype="text",
-            subtype="csv",
-            filename=p.name,
+            buf.getvalue(),
+            maintype="application",
+            subtype="gzip",
+            filename=f"{p.name}.gz",
         )
 
     try:
@@ -240,7 +497,7 @@ def send_email_with_attachments(
                 with smtplib.SMTP_SSL(smtp_host, smtp_port, context=ctx, timeout=60) as server:
                     server.ehlo()
                     server.login(smtp_user, smtp_pass)
-                    server.sendmail(sender, recipients, msg.as_bytes())
+                    server.send_message(msg, sender, recipients)
             else:
                 # assume STARTTLS on 587
                 with smtplib.SMTP(smtp_host, smtp_port, timeout=60) as server:
@@ -248,7 +505,7 @@ def send_email_with_attachments(
                     server.starttls(context=ctx)
                     server.ehlo()
                     server.login(smtp_user, smtp_pass)
-                    server.sendmail(sender, recipients, msg.as_bytes())
+                    server.send_message(msg, sender, recipients)
         else:
             # Generic SMTP
             if smtp_port == 465:
@@ -256,7 +513,7 @@ def send_email_with_attachments(
                     server.ehlo()
                     if smtp_user and smtp_pass:
                         server.login(smtp_user, smtp_pass)
-                    server.sendmail(sender, recipients, msg.as_bytes())
+                    server.send_message(msg, sender, recipients)
             else:
                 with smtplib.SMTP(smtp_host, smtp_port, timeout=60) as server:
                     server.ehlo()
@@ -265,79 +522,194 @@ def send_email_with_attachments(
                         server.ehlo()
                     if smtp_user and smtp_pass:
                         server.login(smtp_user, smtp_pass)
-                    server.sendmail(sender, recipients, msg.as_bytes())
+                    server.send_message(msg, sender, recipients)
 
-        print(f"E-mail sent → {', '.join(recipients)}")
+        logger.info("E-mail sent → %s", ", ".join(recipients))
 
     except smtplib.SMTPAuthenticationError as e:
-        print(f"SMTP Authentication failed: {e}")
-        print("For Gmail: use an **App Password**, not your regular password.")
+        logger.error("SMTP Authentication failed: %s", e)
+        logger.error("For Gmail: use an **App Password**, not your regular password.")
         raise
 
     except Exception as e:
-        print(f"Email sending failed: {e}")
+        logger.error("Email sending failed: %s", e)
         raise
 
 
+# ─────────────────────────────── CONFIG ──────────────────────────────
+def required_env(name):
+    """Return a required setting; KeyError if it is unset or blank."""
+    value = os.environ.get(name, "").strip()
+    if not value:
+        raise KeyError(name)
+    return value
+
+
+@lru_cache(maxsize=1)
+def config():
+    """Load .env (if present) once and return the run settings.
+
+    Optional settings that are unset *or empty* fall back to their default –
+    GitHub Actions passes an undefined secret as "". Raises KeyError naming
+    the first required variable that is missing or blank.
+    """
+    load_dotenv(".env")
+    return SimpleNamespace(
+        access_token=required_env("FB_ACCESS_TOKEN"),
+        api_version=os.environ.get("FB_API_VERSION") or "v20.0",
+        smtp_host=required_env("SMTP_HOST"),
+        smtp_port=os.environ.get("SMTP_PORT") or "587",
+        smtp_user=os.environ.get("SMTP_USER") or "",
+        smtp_pass=os.environ.get("SMTP_PASS") or "",
+        sender=required_env("EMAIL_SENDER"),
+        # max Graph API requests in flight at once, across all accounts
+        max_concurrency=os.environ.get("FB_MAX_CONCURRENCY") or "8",
+        # keep only the N highest-spend ads per report (0 → keep all)
+        csv_topn=os.environ.get("CSV_TOPN") or "0",
+        report_format=(os.environ.get("REPORT_FORMAT") or "csv").lower(),
+        creative_cache_path=(
+            os.environ.get("CREATIVE_CACHE_PATH") or ".creative_cache.sqlite"
+        ),
+        recipients=[
+            r.strip() for r in os.environ.get("EMAIL_RECIPIENTS", "").split(",")
+            if r.strip()
+        ],
+    )
+
+
 # ──────────────────────────────── MAIN ───────────────────────────────
-def main():
-    # 1) load variables from .env into the process environment
-    load_dotenv(".env")      
-
-    # 2) pull them out via os.getenv()
-    access_token = os.getenv("FB_ACCESS_TOKEN")
-    api_version  = os.getenv("FB_API_VERSION")
-    smtp_host    = "smtp.gmail.com"
-    smtp_port    =  "587"
-    smtp_user    = "reporting@upbeatagency.com"
-    smtp_pass    = "afqstkqdculedenp"
-    sender       ="reporting@upbeatagency.com"
-
-    recipients   = [
-        r.strip() for r in os.getenv("EMAIL_RECIPIENTS", "").split(",") if r.strip()
-    ]
-
-    if not all([access_token, smtp_host, sender, recipients]):
-        print("Missing one or more required environment variables – aborting.")
+async def process_account(
+    session, sem, acc, access_token, api_version, cache_path, writer, suffix, topn=0
+):
+    """Fetch → process → save one ad-account; return the report path or None."""
+    acc_id, acc_name = acc["account_id"], acc["name"]
+    logger.info("Processing %s (act_%s)", acc_name, acc_id)
+
+    insights = await get_ad_creative_insights(
+        session, sem, acc_id, access_token, api_version
+    )
+    if not insights:
+        logger.info("act_%s: no insights – skipping", acc_id)
+        return None
+
+    ad_ids    = list(set(map(itemgetter("ad_id"), insights)))
+    creatives = await get_ad_creatives_details(
+        session, sem, ad_ids, access_token, api_version, cache_path
+    )
+
+    # pandas work + file I/O run in a worker thread so the event loop
+    # keeps serving the other accounts' requests meanwhile
+    data = await asyncio.to_thread(process_creative_data, insights, creatives)
+
+    ts    = datetime.now().strftime("%Y%m%d_%H%M%S")
+    file  = f"meta_ads_data_{acc_id}_{ts}.{suffix}"
+    saved = await asyncio.to_thread(writer, data, file, topn)
+    return file if saved else None
+
+
+async def main():
+    # 1) load + validate settings from .env (cached after the first call)
+    try:
+        cfg = config()
+    except KeyError as e:
+        logger.error("Missing or empty required environment variable %s – aborting.", e)
         sys.exit(1)
 
-    print(smtp_host, smtp_port, smtp_user,smtp_pass, sender)
+    if not cfg.recipients:
+        logger.error("EMAIL_RECIPIENTS is empty – aborting.")
+        sys.exit(1)
 
-    csv_files = []
+    try:
+        smtp_port = int(cfg.smtp_port)
+    except ValueError:
+        smtp_port = 0
+    if not 1 <= smtp_port <= 65535:
+        logger.error("SMTP_PORT must be a port number, got %r – aborting.", cfg.smtp_port)
+        sys.exit(1)
 
-    for acc in get_facebook_ads_account(access_token, api_version):
-        acc_id, acc_name = acc["account_id"], acc["name"]
-        print(f"\n{'='*60}\n{acc_name} (act_{acc_id})\n{'='*60}")
+    if cfg.report_format not in REPORT_WRITERS:
+        logger.error(
+            "Unknown REPORT_FORMAT %r – use csv or parquet.", cfg.report_format
+        )
+        sys.exit(1)
 
-        insights = get_ad_creative_insights(acc_id, access_token, api_version)
-        if not insights:
-            print("No insights – skipping")
-            continue
+    try:
+        max_concurrency = int(cfg.max_concurrency)
+    except ValueError:
+        max_concurrency = 0
+    if max_concurrency < 1:
+        logger.error(
+            "FB_MAX_CONCURRENCY must be a whole number ≥ 1, got %r – aborting.",
+            cfg.max_concurrency,
+        )
+        sys.exit(1)
 
-        ad_ids   = list({row["ad_id"] for row in insights})
-        creatives = get_ad_creatives_details(ad_ids, access_token, api_version)
-        data     = process_creative_data(insights, creatives)
+    try:
+        csv_topn = int(cfg.csv_topn)
+    except ValueError:
+        csv_topn = -1
+    if csv_topn < 0:
+        logger.error(
+            "CSV_TOPN must be a whole number ≥ 0 (0 keeps all rows), got %r – aborting.",
+            cfg.csv_topn,
+        )
+        sys.exit(1)
 
-        ts   = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file = f"meta_ads_data_{acc_id}_{ts}.csv"
-        if save_to_csv(data, file):
-            csv_files.append(file)
+    logger.debug(
+        "SMTP %s:%s as %s, sending from %s",
+        cfg.smtp_host, smtp_port, cfg.smtp_user, cfg.sender,
+    )
+
+    # 2) one task per ad-account, all sharing one HTTP session; the semaphore
+    #    is created here so it belongs to this run's event loop
+    sem       = asyncio.Semaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(
+        limit=max_concurrency, limit_per_host=max_concurrency
+    )
+    async with aiohttp.ClientSession(connector=connector) as session:
+        accounts = await get_facebook_ads_account(
+            session, sem, cfg.access_token, cfg.api_version
+        )
+        results  = await asyncio.gather(
+            *[
+                process_account(
+                    session,
+                    sem,
+                    acc,
+                    cfg.access_token,
+                    cfg.api_version,
+                    cfg.creative_cache_path,
+                    REPORT_WRITERS[cfg.report_format],
+                    cfg.report_format,
+                    csv_topn,
+                )
+                for acc in accounts
+            ]
+        )
+    report_files = [f for f in results if f]
 
-    if csv_files:
+    if report_files:
         send_email_with_attachments(
-            smtp_host,
+            cfg.smtp_host,
             smtp_port,
-            smtp_user,
-            smtp_pass,
-            sender,
-            recipients,
+            cfg.smtp_user,
+            cfg.smtp_pass,
+            cfg.sender,
+            cfg.recipients,
             subject=f"Meta Ads Data – {datetime.now():%Y-%m-%d}",
             body="Attached are the latest Meta Ads Data extracts.\n\nRegards,\nAutomation Script",
-            files=csv_files,
+            files=report_files,
         )
     else:
-        print("Nothing to e-mail; no CSVs produced.")
+        logger.info("Nothing to e-mail; no reports produced.")
 
 
 if __name__ == "__main__":
-    main()
+    # .env first, so a LOG_LEVEL set there applies; config() reloading it
+    # later is a no-op (existing variables are not overridden)
+    load_dotenv(".env")
+    logging.basicConfig(
+        level=(os.getenv("LOG_LEVEL") or "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    asyncio.run(main())